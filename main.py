@@ -1,198 +1,432 @@
 import streamlit as st
-from langchain_groq import ChatGroq
-from langchain_core.prompts import PromptTemplate
 import pandas as pd
-import plotly.graph_objects as go
-import plotly.express as px
+import numpy as np
 import os
+import hashlib
+import re
+import orjson
+import threading
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
 
+DATA_FILE = "hospital_patient_data.csv"
+
+# Columns used by the app
+DATA_COLUMNS = [
+    'Patient ID', 'Patient Name', 'Gender', 'Weight (kg)', 'Age', 'Birth Date',
+    'Insurance Provider', 'Allergies', 'Current Medication', 'Past Medical History',
+    'Symptoms', 'Blood Group', 'Heart Rate (bpm)', 'Blood Oxygen Level (%)',
+    'Height (cm)', 'Sugar Level (mg/dL)', 'Blood Pressure Level'
+]
+
+# Vital signs compared against the population average
+PERFORMANCE_KEYS = ['heart_rate_vs_avg', 'blood_oxygen_vs_avg', 'sugar_level_vs_avg']
+
+# Patient fields sent to the LLM
+ANALYSIS_FIELDS = [
+    'Age', 'Gender', 'Blood Group', 'Heart Rate (bpm)', 'Blood Oxygen Level (%)',
+    'Sugar Level (mg/dL)', 'Blood Pressure Level', 'Height (cm)', 'Weight (kg)',
+    'Symptoms', 'Allergies', 'Current Medication', 'Past Medical History'
+]
+
+DATA_DTYPES = {
+    'Patient ID': 'string',
+    'Patient Name': 'string',
+    'Gender': 'category',
+    'Blood Group': 'category',
+    'Insurance Provider': 'string',
+    'Heart Rate (bpm)': 'float32',
+    'Blood Oxygen Level (%)': 'float32',
+    'Sugar Level (mg/dL)': 'float32',
+    'Height (cm)': 'float32',
+    'Weight (kg)': 'float32'
+}
+
+BIRTH_DATE_FORMAT = '%Y-%m-%d'
+
+# Generated analyses are reused for an hour, up to a fixed number of entries
+ANALYSIS_TTL = 3600
+ANALYSIS_CACHE_SIZE = 256
+
+# Number of chart figures kept for reuse
+FIGURE_CACHE_SIZE = 128
+
+# Tag the Parquet copy with its conversion settings, so changing them forces a rebuild
+PARQUET_TAG = hashlib.blake2b(repr((DATA_COLUMNS, DATA_DTYPES, BIRTH_DATE_FORMAT)).encode(), digest_size=4).hexdigest()
+PARQUET_FILE = f"hospital_patient_data.{PARQUET_TAG}.parquet"
+PARQUET_FILE_PATTERN = re.compile(r"hospital_patient_data(\.[0-9a-f]{8})?\.parquet")
+
+def convert_data_to_parquet():
+    """Convert the patient CSV to Parquet if it is missing or out of date."""
+    if os.path.exists(PARQUET_FILE) and (
+        not os.path.exists(DATA_FILE) or os.path.getmtime(PARQUET_FILE) >= os.path.getmtime(DATA_FILE)
+    ):
+        return
+
+    df = pd.read_csv(DATA_FILE, usecols=DATA_COLUMNS, dtype=DATA_DTYPES)
+    # Store birth date as datetime so loads need no conversion
+    df['Birth Date'] = pd.to_datetime(df['Birth Date'], format=BIRTH_DATE_FORMAT, cache=True, errors='coerce')
+
+    # Write to a temporary file first so an interrupted write never leaves a partial copy
+    tmp_file = f"{PARQUET_FILE}.tmp"
+    try:
+        df.to_parquet(tmp_file, index=False)
+        os.replace(tmp_file, PARQUET_FILE)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+    # Remove copies built with other settings, including the untagged one
+    for name in os.listdir('.'):
+        if PARQUET_FILE_PATTERN.fullmatch(name) and name != PARQUET_FILE:
+            os.remove(name)
+
+@st.cache_resource
+def _get_llm():
+    """Get the shared Groq LLM client."""
+    from langchain_groq import ChatGroq
+
+    load_dotenv()
+    groq_api_key = os.getenv('GROQ_API_KEY')
+
+    if not groq_api_key:
+        raise ValueError("GROQ_API_KEY not found in environment variables.")
+
+    return ChatGroq(
+        temperature=0.2,
+        groq_api_key=groq_api_key,
+        model_name="mixtral-8x7b-32768",
+        streaming=True
+    )
+
+@st.cache_resource
+def _analysis_cache():
+    """Get the shared store of generated analyses, keyed on patient ID and data hash."""
+    return threading.Lock(), OrderedDict()
+
+def _get_cached_analysis(key):
+    """Get a cached analysis, or None if it is missing or expired."""
+    lock, entries = _analysis_cache()
+    with lock:
+        entry = entries.get(key)
+        if entry is None:
+            return None
+
+        created, analysis = entry
+        if time.monotonic() - created > ANALYSIS_TTL:
+            del entries[key]
+            return None
+
+        return analysis
+
+def _store_analysis(key, analysis):
+    """Cache an analysis, evicting the oldest entries beyond the size limit."""
+    lock, entries = _analysis_cache()
+    with lock:
+        entries[key] = (time.monotonic(), analysis)
+        entries.move_to_end(key)
+        while len(entries) > ANALYSIS_CACHE_SIZE:
+            entries.popitem(last=False)
+
+# Analysis prompt template
+_ANALYSIS_TEMPLATE = """
+### PATIENT DATA:
+{data}
+
+### INSTRUCTION:
+Analyze the patient's health status based on all available metrics.
+Structure your analysis as follows:
+
+1. OVERALL HEALTH STATUS:
+- Analyze vital signs compared to normal ranges
+- Highlight any concerning metrics
+- Consider age and gender factors
+
+2. SYMPTOMS ANALYSIS:
+- Evaluate reported symptoms
+- Identify potential correlations
+- Assess severity
+
+3. PRESCRIPTION:
+- Recommend generic medications based on symptoms
+- Specify dosage and duration
+- List potential side effects
+
+4. LIFESTYLE RECOMMENDATIONS:
+- Suggest dietary modifications
+- Recommend exercise routines if applicable
+- Propose lifestyle changes
+
+5. PRECAUTIONS & FOLLOW-UP:
+- List necessary precautions
+- Recommend follow-up timeline
+- Suggest additional tests if needed
+
+Format the analysis using clear markdown headings and bullet points.
+
+### ANALYSIS:
+"""
+
+@st.cache_resource
+def _get_analysis_prompt():
+    """Get the analysis prompt, compiled once."""
+    from langchain_core.prompts import PromptTemplate
+
+    return PromptTemplate.from_template(_ANALYSIS_TEMPLATE)
+
+def _analysis_key(patient, data):
+    """Get the analysis cache key for a patient's formatted data."""
+    return patient['Patient ID'], hashlib.blake2b(data.encode()).hexdigest()
+
+@st.cache_resource(max_entries=FIGURE_CACHE_SIZE)
+def _build_vitals_fig(performance_items):
+    """Build the vitals chart for (metric, % vs average) pairs."""
+    import plotly.graph_objects as go
+
+    metrics = [m for m, _ in performance_items]
+    values = [v for _, v in performance_items]
+
+    # Clean metric names
+    display_metrics = [m.replace('_vs_avg', '').replace('_', ' ').title() for m in metrics]
+
+    # Create color scale based on medical ranges
+    deviation = np.abs(values)
+    colors = np.select([deviation > 15, deviation > 10], ['#e74c3c', '#f39c12'], default='#2ecc71').tolist()
+
+    fig = go.Figure(data=[
+        go.Bar(
+            x=display_metrics,
+            y=values,
+            marker_color=colors,
+            text=[f"{v:+.1f}%" for v in values],
+            textposition='auto',
+        )
+    ])
+
+    fig.update_layout(
+        title={
+            'text': "Vital Signs vs Population Average",
+            'y': 0.95,
+            'x': 0.5,
+            'xanchor': 'center',
+            'yanchor': 'top'
+        },
+        xaxis_title="Vital Signs",
+        yaxis_title="% Difference from Average",
+        template="plotly_white",
+        height=400,
+        margin=dict(t=50, l=0, r=0, b=0),
+        yaxis=dict(
+            gridcolor='rgba(0,0,0,0.1)',
+            zerolinecolor='rgba(0,0,0,0.2)'
+        )
+    )
+
+    return fig
+
+@st.cache_resource(max_entries=FIGURE_CACHE_SIZE)
+def _build_bmi_fig(bmi):
+    """Build the BMI gauge chart."""
+    import plotly.graph_objects as go
+
+    fig = go.Figure(go.Indicator(
+        mode="gauge+number",
+        value=bmi,
+        domain={'x': [0, 1], 'y': [0, 1]},
+        gauge={
+            'axis': {'range': [None, 40]},
+            'steps': [
+                {'range': [0, 18.5], 'color': "#3498db"},
+                {'range': [18.5, 24.9], 'color': "#2ecc71"},
+                {'range': [24.9, 29.9], 'color': "#f1c40f"},
+                {'range': [29.9, 40], 'color': "#e74c3c"}
+            ],
+            'threshold': {
+                'line': {'color': "red", 'width': 4},
+                'thickness': 0.75,
+                'value': bmi
+            }
+        },
+        title={'text': "BMI Index"}
+    ))
+
+    return fig
+
 class PatientAnalyzer:
     def __init__(self):
         try:
             # Load data
-            self.df = pd.read_csv("hospital_patient_data.csv")
-            # Convert birth date to datetime
-            self.df['Birth Date'] = pd.to_datetime(self.df['Birth Date'])
+            convert_data_to_parquet()
+            self.df = pd.read_parquet(PARQUET_FILE, columns=DATA_COLUMNS, dtype_backend='pyarrow')
         except FileNotFoundError:
             st.error("Could not find hospital_patient_data.csv in the current directory.")
             st.stop()
 
+        # Split symptoms once for the whole frame
+        self._symptoms = self.df['Symptoms'].str.split(', ').tolist()
+
+        # Index rows by patient ID, keeping the first row for each ID
+        self._pid_index = {}
+        for i, pid in enumerate(self.df['Patient ID'].to_numpy()):
+            self._pid_index.setdefault(pid, i)
+
+        # Build patient display labels
+        self._patient_labels = (
+            self.df['Patient ID'].astype(str) + ' (' + self.df['Patient Name'].astype(str) + ')'
+        ).tolist()
+        self._pid_by_label = dict(zip(self._patient_labels, self.df['Patient ID']))
+
+        # Read numeric columns as contiguous float32 arrays
+        hr = self.df['Heart Rate (bpm)'].to_numpy(np.float32)
+        ox = self.df['Blood Oxygen Level (%)'].to_numpy(np.float32)
+        sg = self.df['Sugar Level (mg/dL)'].to_numpy(np.float32)
+        ht = self.df['Height (cm)'].to_numpy(np.float32)
+        wt = self.df['Weight (kg)'].to_numpy(np.float32)
+
+        # Calculate BMI for every patient
+        height_m = ht / 100.0
+        self._bmi = wt / (height_m * height_m)
+
+        # Calculate population statistics for vital signs
+        self.vital_stats = {
+            'heart_rate': self.df['Heart Rate (bpm)'].agg(['mean', 'median', 'min', 'max']).to_dict(),
+            'blood_oxygen': self.df['Blood Oxygen Level (%)'].agg(['mean', 'median', 'min', 'max']).to_dict(),
+            'sugar_level': self.df['Sugar Level (mg/dL)'].agg(['mean', 'median', 'min', 'max']).to_dict()
+        }
+        means = np.array([stats['mean'] for stats in self.vital_stats.values()])
+
+        # Calculate performance vs average for every patient
+        vitals = np.column_stack((hr, ox, sg))
+        self._performance = np.round((vitals / means - 1.0) * 100.0, 2)
+
         # Initialize LLM
         self.setup_llm()
 
     def setup_llm(self):
         """Setup the Groq LLM."""
         try:
-            load_dotenv()
-            groq_api_key = os.getenv('GROQ_API_KEY')
-
-            if not groq_api_key:
-                raise ValueError("GROQ_API_KEY not found in environment variables.")
-
-            self.llm = ChatGroq(
-                temperature=0.2,
-                groq_api_key=groq_api_key,
-                model_name="mixtral-8x7b-32768"
-            )
+            self.llm = _get_llm()
+            self._chain = _get_analysis_prompt() | self.llm
         except Exception as e:
             st.error(f"Error initializing Groq LLM: {str(e)}")
             st.stop()
 
     def get_available_patients(self):
         """Get list of available patient IDs."""
-        return [f"{pid} ({name})" for pid, name in zip(self.df['Patient ID'], self.df['Patient Name'])]
+        return self._patient_labels
 
     def get_patient_metrics(self, patient_id):
-        """Calculate patient health metrics and statistics."""
-        # Extract actual patient_id from the display string
-        actual_patient_id = patient_id.split(" (")[0]
-
-        # Filter data
-        patient = self.df[self.df['Patient ID'] == actual_patient_id]
+        """Calculate patient health metrics and statistics, along with the patient's row index."""
+        # Look up patient row from the display string
+        row_idx = self._pid_index.get(self._pid_by_label.get(patient_id))
 
-        if patient.empty:
-            return None, None, None
+        if row_idx is None:
+            return None, None, None, None
 
-        patient = patient.iloc[0]
+        patient = self.df.iloc[row_idx]
 
-        # Calculate metrics for vital signs
-        vital_stats = {
-            'heart_rate': self.df['Heart Rate (bpm)'].agg(['mean', 'median', 'min', 'max']).to_dict(),
-            'blood_oxygen': self.df['Blood Oxygen Level (%)'].agg(['mean', 'median', 'min', 'max']).to_dict(),
-            'sugar_level': self.df['Sugar Level (mg/dL)'].agg(['mean', 'median', 'min', 'max']).to_dict()
-        }
+        # Look up performance vs average
+        performance = dict(zip(PERFORMANCE_KEYS, self._performance[row_idx].tolist()))
 
-        # Calculate performance vs average
-        performance = {
-            'heart_rate_vs_avg': round((patient['Heart Rate (bpm)'] / vital_stats['heart_rate']['mean'] - 1) * 100, 2),
-            'blood_oxygen_vs_avg': round((patient['Blood Oxygen Level (%)'] / vital_stats['blood_oxygen']['mean'] - 1) * 100, 2),
-            'sugar_level_vs_avg': round((patient['Sugar Level (mg/dL)'] / vital_stats['sugar_level']['mean'] - 1) * 100, 2)
-        }
+        return patient, self.vital_stats, performance, row_idx
 
-        return patient, vital_stats, performance
+    def get_symptoms(self, row_idx):
+        """Get the list of reported symptoms for a patient row."""
+        return self._symptoms[row_idx] or []
 
     def create_vitals_chart(self, performance_data):
         """Create vitals visualization."""
-        metrics = list(performance_data.keys())
-        values = list(performance_data.values())
-
-        # Clean metric names
-        display_metrics = [m.replace('_vs_avg', '').replace('_', ' ').title() for m in metrics]
-
-        # Create color scale based on medical ranges
-        colors = ['#e74c3c' if abs(v) > 15 else '#f39c12' if abs(v) > 10 else '#2ecc71' for v in values]
-
-        fig = go.Figure(data=[
-            go.Bar(
-                x=display_metrics,
-                y=values,
-                marker_color=colors,
-                text=[f"{v:+.1f}%" for v in values],
-                textposition='auto',
-            )
-        ])
-
-        fig.update_layout(
-            title={
-                'text': "Vital Signs vs Population Average",
-                'y': 0.95,
-                'x': 0.5,
-                'xanchor': 'center',
-                'yanchor': 'top'
-            },
-            xaxis_title="Vital Signs",
-            yaxis_title="% Difference from Average",
-            template="plotly_white",
-            height=400,
-            margin=dict(t=50, l=0, r=0, b=0),
-            yaxis=dict(
-                gridcolor='rgba(0,0,0,0.1)',
-                zerolinecolor='rgba(0,0,0,0.2)'
-            )
-        )
-
+        fig = _build_vitals_fig(tuple(performance_data.items()))
         st.plotly_chart(fig, use_container_width=True)
 
-    def create_bmi_chart(self, height, weight):
+    def create_bmi_chart(self, row_idx):
         """Create BMI visualization."""
-        bmi = weight / ((height/100) ** 2)
-        
-        fig = go.Figure(go.Indicator(
-            mode="gauge+number",
-            value=bmi,
-            domain={'x': [0, 1], 'y': [0, 1]},
-            gauge={
-                'axis': {'range': [None, 40]},
-                'steps': [
-                    {'range': [0, 18.5], 'color': "#3498db"},
-                    {'range': [18.5, 24.9], 'color': "#2ecc71"},
-                    {'range': [24.9, 29.9], 'color': "#f1c40f"},
-                    {'range': [29.9, 40], 'color': "#e74c3c"}
-                ],
-                'threshold': {
-                    'line': {'color': "red", 'width': 4},
-                    'thickness': 0.75,
-                    'value': bmi
-                }
-            },
-            title={'text': "BMI Index"}
-        ))
-
+        fig = _build_bmi_fig(float(self._bmi[row_idx]))
         st.plotly_chart(fig, use_container_width=True)
 
-    def generate_analysis(self, patient, stats, performance):
-        """Generate AI analysis of the patient's health status."""
+    def _format_analysis_data(self, patient, stats, performance):
+        """Format patient data for the analysis prompt."""
         analysis_data = {
-            'patient_details': patient.to_dict(),
-            'vital_statistics': stats,
-            'performance': performance
+            'patient_details': {
+                k: round(float(v), 2) if isinstance(v, (float, np.floating)) else v
+                for k, v in patient[ANALYSIS_FIELDS].items() if pd.notna(v)
+            },
+            'vital_statistics': {
+                name: {k: round(float(v), 2) for k, v in values.items()} for name, values in stats.items()
+            },
+            'performance': {k: float(v) for k, v in performance.items()}
         }
+        return orjson.dumps(analysis_data, default=str).decode()
 
-        prompt = PromptTemplate.from_template("""
-            ### PATIENT DATA:
-            {data}
+    def generate_analysis(self, patient, stats, performance, placeholder):
+        """Generate AI analysis of the patient's health status, streaming it into placeholder."""
+        data = self._format_analysis_data(patient, stats, performance)
+        key = _analysis_key(patient, data)
+        cached = _get_cached_analysis(key)
 
-            ### INSTRUCTION:
-            Analyze the patient's health status based on all available metrics.
-            Structure your analysis as follows:
+        if cached is not None:
+            placeholder.markdown(cached)
+            return cached
 
-            1. OVERALL HEALTH STATUS:
-            - Analyze vital signs compared to normal ranges
-            - Highlight any concerning metrics
-            - Consider age and gender factors
-
-            2. SYMPTOMS ANALYSIS:
-            - Evaluate reported symptoms
-            - Identify potential correlations
-            - Assess severity
+        try:
+            analysis = ""
+            for chunk in self._chain.stream({"data": data}):
+                analysis += chunk.content
+                placeholder.markdown(analysis)
+        except Exception as e:
+            st.error(f"Error generating analysis: {str(e)}")
+            return None
 
-            3. PRESCRIPTION:
-            - Recommend generic medications based on symptoms
-            - Specify dosage and duration
-            - List potential side effects
+        _store_analysis(key, analysis)
+        return analysis
+
+    def generate_batch_analysis(self, patient_ids):
+        """Generate AI analyses for several patients in one batched request."""
+        analyses = {}
+        pending = []
+        for patient_id in patient_ids:
+            patient, stats, performance, _ = self.get_patient_metrics(patient_id)
+            if patient is None:
+                continue
+
+            data = self._format_analysis_data(patient, stats, performance)
+            key = _analysis_key(patient, data)
+            cached = _get_cached_analysis(key)
+            if cached is not None:
+                analyses[patient_id] = cached
+            else:
+                pending.append((patient_id, key, data))
+
+        if pending:
+            results = self._chain.batch(
+                [{"data": data} for _, _, data in pending],
+                config={'max_concurrency': 8},
+                return_exceptions=True
+            )
 
-            4. LIFESTYLE RECOMMENDATIONS:
-            - Suggest dietary modifications
-            - Recommend exercise routines if applicable
-            - Propose lifestyle changes
+            for (patient_id, key, _), result in zip(pending, results):
+                if isinstance(result, Exception):
+                    st.error(f"Error generating analysis for {patient_id}: {str(result)}")
+                    continue
 
-            5. PRECAUTIONS & FOLLOW-UP:
-            - List necessary precautions
-            - Recommend follow-up timeline
-            - Suggest additional tests if needed
+                analyses[patient_id] = result.content
+                _store_analysis(key, result.content)
 
-            Format the analysis using clear markdown headings and bullet points.
+        # Keep the selection order
+        return {patient_id: analyses[patient_id] for patient_id in patient_ids if patient_id in analyses}
 
-            ### ANALYSIS:
-        """)
+def get_data_version():
+    """Get the modification time of the patient data file, used as a cache key."""
+    try:
+        return os.path.getmtime(DATA_FILE)
+    except OSError:
+        return None
 
-        try:
-            chain = prompt | self.llm
-            return chain.invoke({"data": str(analysis_data)}).content
-        except Exception as e:
-            st.error(f"Error generating analysis: {str(e)}")
-            return None
+@st.cache_resource(max_entries=1)
+def get_analyzer(data_version):
+    """Get a PatientAnalyzer shared across reruns, rebuilt when the data file changes."""
+    return PatientAnalyzer()
 
 def main():
     # Page config
@@ -246,7 +480,8 @@ def main():
         st.markdown("---")
 
         # Initialize analyzer
-        analyzer = PatientAnalyzer()
+        data_version = get_data_version()
+        analyzer = get_analyzer(data_version)
 
         # Patient selection
         available_patients = analyzer.get_available_patients()
@@ -261,7 +496,7 @@ def main():
             if patient_id:
                 with st.spinner("🤖 Analyzing patient data..."):
                     # Get patient metrics
-                    patient, stats, performance = analyzer.get_patient_metrics(patient_id)
+                    patient, stats, performance, row_idx = analyzer.get_patient_metrics(patient_id)
 
                     if patient is not None:
                         # Create tabs
@@ -286,30 +521,44 @@ def main():
                             
                             # BMI Chart
                             st.markdown("### 📊 BMI Analysis")
-                            analyzer.create_bmi_chart(patient['Height (cm)'], patient['Weight (kg)'])
+                            analyzer.create_bmi_chart(row_idx)
 
                             # Symptoms
                             st.markdown("### 🤒 Reported Symptoms")
-                            symptoms = patient['Symptoms'].split(', ')
-                            for symptom in symptoms:
+                            for symptom in analyzer.get_symptoms(row_idx):
                                 st.markdown(f"- {symptom}")
 
                         with tab2:
                             # AI Analysis and Prescription
                             st.markdown("### 🤖 AI Analysis & Recommendations")
-                            analysis = analyzer.generate_analysis(patient, stats, performance)
-                            if analysis:
-                                st.markdown(analysis)
+                            analyzer.generate_analysis(patient, stats, performance, st.empty())
 
                         with tab3:
                             st.markdown("### 📊 Raw Patient Data")
                             st.dataframe(
-                                analyzer.df[analyzer.df['Patient ID'] == patient_id.split(" (")[0]],
+                                analyzer.df.iloc[[row_idx]],
                                 use_container_width=True
                             )
                     else:
                         st.error("Could not find patient data.")
 
+        # Batch analysis
+        st.markdown("### 📋 Batch Analysis")
+        batch_patients = st.multiselect(
+            "Select Patients",
+            options=available_patients,
+            help="Choose patients to analyze together"
+        )
+
+        if st.button("📋 Batch Analyze"):
+            if batch_patients:
+                with st.spinner("🤖 Analyzing patients..."):
+                    analyses = analyzer.generate_batch_analysis(batch_patients)
+
+                for label, analysis in analyses.items():
+                    with st.expander(label):
+                        st.markdown(analysis)
+
         # Footer
         st.markdown("---")
         col1, col2, col3 = st.columns(3)